@@ -0,0 +1,59 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+
+RESPONSE = json.dumps(
+    {"data": {"repository": {"title": "xxx", "url": "example.com"}}}
+).encode("utf-8")
+
+
+class StubGraphQLHandler(BaseHTTPRequestHandler):
+    """Answers every POST with a canned GraphQL response after a delay"""
+
+    protocol_version = "HTTP/1.1"
+    # Buffer so headers and body go out in one segment on keep-alive sockets
+    wbufsize = 64 * 1024
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubGraphQLServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency):
+        super().__init__(("127.0.0.1", 0), StubGraphQLHandler)
+        self.latency = latency
+
+    @property
+    def url(self):
+        return "http://{}:{}/graphql".format(*self.server_address)
+
+
+@pytest.fixture(scope="session", params=[0, 0.005], ids=["0ms", "5ms"])
+def stub_server(request):
+    """Local GraphQL endpoint with injected per-request latency (seconds)"""
+    server = StubGraphQLServer(latency=request.param)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,39 @@
+import asyncio
+
+from py2graphql import Client
+
+REQUESTS_PER_ROUND = 20
+
+
+def make_query(client):
+    return (
+        client.query()
+        .repository(owner="juliuscaeser", name="rome")
+        .values("title", "url")
+    )
+
+
+def test_fetch_sync(benchmark, stub_server):
+    with Client(stub_server.url, {}) as client:
+
+        def run():
+            for _ in range(REQUESTS_PER_ROUND):
+                make_query(client).fetch()
+
+        benchmark(run)
+
+
+def test_fetch_async(benchmark, stub_server):
+    client = Client(stub_server.url, {})
+    loop = asyncio.new_event_loop()
+
+    async def gather():
+        await asyncio.gather(
+            *[make_query(client).fetch_async() for _ in range(REQUESTS_PER_ROUND)]
+        )
+
+    try:
+        benchmark(lambda: loop.run_until_complete(gather()))
+    finally:
+        client.close()
+        loop.close()
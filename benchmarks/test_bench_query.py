@@ -0,0 +1,56 @@
+import pytest
+
+from py2graphql import Query
+
+
+def build_tree(width, depth):
+    query = Query()
+    nodes = [query]
+    for level in range(depth):
+        children = []
+        for node in nodes:
+            for i in range(width):
+                child = getattr(node, "field{}_{}".format(level, i))(
+                    first=10, after="cursor"
+                )
+                child.values("id", "name")
+                children.append(child)
+        nodes = children
+    return query
+
+
+SHAPES = [(1, 1), (1, 20), (5, 3), (20, 2), (100, 1)]
+SHAPE_IDS = ["w{}d{}".format(*shape) for shape in SHAPES]
+
+
+@pytest.mark.parametrize("width,depth", SHAPES, ids=SHAPE_IDS)
+def test_build(benchmark, width, depth):
+    benchmark(build_tree, width, depth)
+
+
+@pytest.mark.parametrize("indentation", [0, 2], ids=["flat", "indented"])
+@pytest.mark.parametrize("width,depth", SHAPES, ids=SHAPE_IDS)
+def test_render(benchmark, width, depth, indentation):
+    """Render without the document cache"""
+    query = build_tree(width, depth)
+    benchmark(query._to_graphql, indentation=indentation)
+
+
+@pytest.mark.parametrize("indentation", [0, 2], ids=["flat", "indented"])
+@pytest.mark.parametrize("width,depth", SHAPES, ids=SHAPE_IDS)
+def test_render_cached(benchmark, width, depth, indentation):
+    """Render a tree whose document is already cached"""
+    query = build_tree(width, depth)
+    query.to_graphql(indentation=indentation)
+    benchmark(query.to_graphql, indentation=indentation)
+
+
+@pytest.mark.parametrize("width,depth", SHAPES, ids=SHAPE_IDS)
+def test_render_rebuilt(benchmark, width, depth):
+    """Render a freshly built tree that's structurally identical to a cached one"""
+    build_tree(width, depth).to_graphql()
+    benchmark.pedantic(
+        lambda query: query.to_graphql(),
+        setup=lambda: ((build_tree(width, depth),), {}),
+        rounds=50,
+    )
@@ -0,0 +1,44 @@
+import pytest
+
+from py2graphql import Literal
+from py2graphql.serialization import serialize_arg
+
+
+def nested_payload(width, depth):
+    if depth == 0:
+        return {
+            "name": 'Julius "Caesar"\n',
+            "count": 42,
+            "ratio": 0.5,
+            "active": True,
+            "kind": Literal("ADMIN"),
+            "missing": None,
+        }
+    return {
+        "items": [nested_payload(width, depth - 1) for _ in range(width)],
+        "label": "level {}".format(depth),
+    }
+
+
+PAYLOADS = [(10, 1), (10, 3), (100, 2)]
+
+
+@pytest.mark.parametrize(
+    "width,depth", PAYLOADS, ids=["w{}d{}".format(*p) for p in PAYLOADS]
+)
+def test_serialize_nested(benchmark, width, depth):
+    payload = nested_payload(width, depth)
+    benchmark(serialize_arg, payload)
+
+
+MARKDOWN = '# Title\n\nSome *markdown* with "quotes" and a \\ backslash.\n'
+PLAIN = "Plain text without anything that needs escaping. "
+UNICODE = 'Ünïcödé *markdown* with "quotes" and emoji 😀\n'
+
+
+@pytest.mark.parametrize(
+    "text", [MARKDOWN, PLAIN, UNICODE], ids=["markdown", "plain", "unicode"]
+)
+@pytest.mark.parametrize("size", [1024, 1024 * 1024], ids=["1KiB", "1MiB"])
+def test_serialize_string(benchmark, size, text):
+    benchmark(serialize_arg, (text * (size // len(text) + 1))[:size])
@@ -3,13 +3,17 @@ from .core import (
     Mutation,
     Query,
 )
+from .document import fingerprint
 from .exception import (
+    BatchLoadError,
     GraphQLError,
     GraphQLEndpointError,
     InfinityNotSupportedError,
     UnserializableTypeError,
     ValuesRequiresArgumentsError,
 )
+from .normalized import NormalizedCache
+from .profiling import profile
 from .types import (
     Aliased,
     Literal,
@@ -18,14 +22,18 @@ from .types import (
 
 __all__ = [
     "Aliased",
+    "BatchLoadError",
     "Client",
     "GraphQLEndpointError",
     "GraphQLError",
     "InfinityNotSupportedError",
     "Literal",
     "Mutation",
+    "NormalizedCache",
     "Query",
     "UnserializableTypeError",
     "ValuesRequiresArgumentsError",
     "Variable",
+    "fingerprint",
+    "profile",
 ]
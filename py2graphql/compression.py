@@ -0,0 +1,88 @@
+import zlib
+
+
+# Characters of the request body encoded and compressed at a time, so the
+# whole body never exists both as a str and as uncompressed bytes
+CHUNK_SIZE = 64 * 1024
+
+
+# Optional libraries are imported on first use, keeping import py2graphql cheap
+def _brotli():
+    try:
+        import brotli  # type: ignore
+    except ImportError:
+        try:
+            import brotlicffi as brotli  # type: ignore
+        except ImportError:
+            return None
+    return brotli
+
+
+def _zstandard():
+    try:
+        import zstandard  # type: ignore
+    except ImportError:
+        return None
+    return zstandard
+
+
+class _ZlibCompressor(object):
+    def __init__(self, wbits: int):
+        self._compressor = zlib.compressobj(wbits=wbits)
+
+    def compress(self, data: bytes):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor(object):
+    def __init__(self, brotli):
+        self._compressor = brotli.Compressor()
+
+    def compress(self, data: bytes):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def _compressor(encoding: str):
+    if encoding == "gzip":
+        return _ZlibCompressor(wbits=16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        return _ZlibCompressor(wbits=zlib.MAX_WBITS)
+    elif encoding == "br":
+        brotli = _brotli()
+        if brotli:
+            return _BrotliCompressor(brotli)
+    elif encoding == "zstd":
+        zstandard = _zstandard()
+        if zstandard:
+            return zstandard.ZstdCompressor().compressobj()
+    else:
+        raise ValueError("Unsupported content encoding: {}".format(encoding))
+    raise ImportError(
+        "Please install '{}' to use {} compression.".format(
+            "brotli" if encoding == "br" else "zstandard", encoding
+        )
+    )
+
+
+def check_encoding(encoding: str):
+    """Raise if encoding can't be used for request compression"""
+    _compressor(encoding)
+
+
+def compress(body: str, encoding: str):
+    """
+    Encode body as UTF-8 and compress it, a chunk at a time
+    """
+    compressor = _compressor(encoding)
+    chunks = [
+        compressor.compress(body[i : i + CHUNK_SIZE].encode("utf-8"))
+        for i in range(0, len(body), CHUNK_SIZE)
+    ]
+    chunks.append(compressor.flush())
+    return b"".join(chunks)
@@ -1,32 +1,15 @@
-import importlib.util
+import functools
 import json
+import threading
 from typing import List
 
-# Optional imports
-requests = None
-aiohttp = None
-httpx = None
-
-# Try to import HTTP clients
-try:
-    import requests
-except ImportError:
-    pass
-
-try:
-    import aiohttp
-except ImportError:
-    pass
-
-try:
-    import httpx
-except ImportError:
-    pass
-
-from tenacity import retry
-from tenacity import stop_after_attempt  # type: ignore
-from tenacity.wait import wait_fixed  # type: ignore
-
+from . import compression
+from . import profiling
+from .document import document_cache
+from .document import Fingerprint
+from .document import freeze_args
+from .document import freeze_value
+from .document import has_mutable_args
 from .exception import GraphQLEndpointError
 from .exception import GraphQLError
 from .exception import ValuesRequiresArgumentsError
@@ -35,6 +18,7 @@ from .types import Aliased
 
 
 DEFAULT_TIMEOUT = 25
+DEFAULT_COMPRESSION_THRESHOLD = 1024
 
 
 class Query(object):
@@ -49,12 +33,14 @@ class Query(object):
         parent=None,
         operation_name: str = None,
         operation_variables=[],
+        alias: str = None,
     ):
         """
         Kwargs:
            name (str): Client used for sending queries.
            client: Client used for sending queries.
            parent (Query): Query that calls this query.
+           alias (str): Response key for this field.
         """
 
         self._operation_type = operation_type
@@ -65,26 +51,114 @@ class Query(object):
         self._parent = parent
         self._operation_name = operation_name
         self._operation_variables = operation_variables
+        self._alias = alias
+        # Hashable copies of the call args and values, built as they're set
+        self._frozen_args = None
+        self._frozen_values: List = []
+        self._fingerprint = None
+        # Set when the args hold dicts or lists, which may be mutated after
+        # they're passed, so they're frozen again every time
+        self._mutable_args = False
+        # Set when the subtree has mutable args, so its fingerprint can't be
+        # kept
+        self._volatile = False
+        # (document, future) of the request started by prefetch()
+        self._prefetched = None
+        if profiling.active is not None:
+            profiling.active.record_node(self)
 
     def __getattr__(self, key: str):
-        q = Query(operation_type=key, parent=self)
+        return self._field(key)
+
+    def _field(self, name: str, alias: str = None):
+        q = Query(operation_type=name, parent=self, alias=alias)
         self._nodes.append(q)
+        self._changed()
         return q
 
     def __call__(self, *args, **kwargs):
         self._call_args = kwargs
+        self._mutable_args = has_mutable_args(kwargs)
+        if self._mutable_args:
+            self._frozen_args = None
+            self._mark_volatile()
+        else:
+            self._frozen_args = freeze_args(kwargs) if kwargs else None
+        self._changed()
+        if profiling.active is not None:
+            profiling.active.record_args(self, kwargs)
         return self
 
     def values(self, *args):
         if not args:
             raise ValuesRequiresArgumentsError
         self._values_to_show.extend(args)
+        self._frozen_values.extend(map(freeze_value, args))
+        self._changed()
         return self
 
+    def _changed(self):
+        # A cached fingerprint implies cached fingerprints all the way down,
+        # so we can stop at the first ancestor that has none
+        node = self
+        while node is not None and node._fingerprint is not None:
+            node._fingerprint = None
+            node = node._parent
+
+    def _mark_volatile(self):
+        node = self
+        while node is not None and not node._volatile:
+            node._volatile = True
+            node._fingerprint = None
+            node = node._parent
+
+    def _get_fingerprint(self):
+        if self._fingerprint is not None:
+            return self._fingerprint
+        frozen_args = self._frozen_args
+        if self._mutable_args:
+            frozen_args = freeze_args(self._call_args)
+        fingerprint = Fingerprint(
+            (
+                type(self),
+                self._operation_type,
+                self._alias,
+                frozen_args,
+                tuple(self._frozen_values),
+                tuple([node._get_fingerprint() for node in self._nodes]),
+                self._operation_name,
+                tuple(map(tuple, self._operation_variables)),
+            )
+        )
+        if not self._volatile:
+            self._fingerprint = fingerprint
+        return fingerprint
+
     def to_graphql(self, indentation: int = 2):
-        return self._get_root()._to_graphql(indentation=indentation)
+        root = self._get_root()
+        if profiling.active is not None or root._operation_type == "mutation":
+            # Mutations are mostly one-off, so they aren't cached
+            return root._to_graphql(indentation=indentation)
+        try:
+            key = (root._get_fingerprint(), indentation)
+        except TypeError:
+            # Unhashable arguments, skip the cache
+            return root._to_graphql(indentation=indentation)
+
+        document = document_cache.get(key)
+        if document is None:
+            document = root._to_graphql(indentation=indentation)
+            document_cache.set(key, document)
+        return document
 
     def _to_graphql(self, tab: int = 2, indentation: int = 2):
+        if profiling.active is not None:
+            return profiling.active.record_render(
+                self, self._render, tab, indentation
+            )
+        return self._render(tab, indentation)
+
+    def _render(self, tab: int, indentation: int):
         if not indentation:
             tab = 0
             nl = ""
@@ -102,6 +176,9 @@ class Query(object):
         else:
             name = self._operation_type
 
+        if self._alias:
+            name = "{0}: {1}".format(self._alias, name)
+
         nodes = [v for v in self._values_to_show]
         nodes.extend(
             [
@@ -156,43 +233,47 @@ class Query(object):
             return self
 
     def __getitem__(self, x: str):
-        return self.fetch()[x]
-
-    def fetch(self, variables={}):
-        root = self._get_root()
-        client = root._client
-        graphql = root.to_graphql()
+        return self._fetch_or_prefetched()[x]
 
-        response_content = client.fetch(graphql, variables)
+    def prefetch(self, variables={}):
+        """
+        Start sending the query now, on the client's thread pool.
 
-        errors = response_content.get("errors")
-        if errors is not None:
-            raise GraphQLError(response_content)
+        Returns a concurrent.futures.Future of the result. The next subscript
+        or iteration of the query waits for this request instead of sending
+        a new one; later ones fetch again as usual. From async code, await
+        asyncio.wrap_future() of the returned future.
+        """
+        root = self._get_root()
+        # Rendered before the worker thread gets to the tree
+        document = root.to_graphql()
+        future = root._client.executor.submit(root._client.execute, root, variables)
+        root._prefetched = (document, future)
+        return future
 
-        data = response_content.get("data", {})
+    def _fetch_or_prefetched(self):
+        root = self._get_root()
+        prefetched, root._prefetched = root._prefetched, None
+        if prefetched is not None:
+            document, future = prefetched
+            # The tree may have changed since it was prefetched
+            if document == root.to_graphql():
+                return future.result()
+        return self.fetch()
 
-        return client.pre_response(data, root_node=root)
+    def fetch(self, variables={}):
+        root = self._get_root()
+        return root._client.execute(root, variables)
 
     async def fetch_async(self, variables={}):
         root = self._get_root()
-        client = root._client
-        graphql = root.to_graphql()
-
-        response_content = await client.fetch_async(graphql, variables)
-
-        errors = response_content.get("errors")
-        if errors is not None:
-            raise GraphQLError(response_content)
-
-        data = response_content.get("data", {})
-
-        return client.pre_response(data, root_node=root)
+        return await root._client.execute_async(root, variables)
 
     def __str__(self):
         return self.to_graphql()
 
     def __iter__(self):
-        item = self.fetch()
+        item = self._fetch_or_prefetched()
         if isinstance(item, dict):
             return item.items()
         elif isinstance(item, list):
@@ -206,33 +287,100 @@ class Mutation(Query):
         super(Mutation, self).__init__(operation_type=operation_type, **kwargs)
 
 
-@retry(wait=wait_fixed(2), stop=stop_after_attempt(3))
-async def do_request_async(url: str, body, headers: dict):
-    if aiohttp:
-        timeout = aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT)
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url, data=body, headers=headers, timeout=timeout
-            ) as response:
-                await response.text()
-                return response
-    elif httpx:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url, data=body, headers=headers, timeout=DEFAULT_TIMEOUT
-            )
-            return response
-    else:
-        raise ImportError(
-            "No async HTTP client available. Please install either 'aiohttp' or 'httpx'."
-        )
+def _retry(fn):
+    """
+    Retry the coroutine function fn with tenacity, which is imported when fn
+    is first called
+    """
+    retrying = []
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if not retrying:
+            from tenacity import retry
+            from tenacity import stop_after_attempt  # type: ignore
+            from tenacity.wait import wait_fixed  # type: ignore
+
+            retrying.append(retry(wait=wait_fixed(2), stop=stop_after_attempt(3))(fn))
+        return await retrying[0](*args, **kwargs)
+
+    return wrapper
+
+
+def _result_or_exception(future):
+    try:
+        return future.result()
+    except Exception as e:
+        return e
 
 
 class Client(object):
-    def __init__(self, url: str, headers, middleware=[]):
+    def __init__(
+        self,
+        url: str,
+        headers,
+        middleware=[],
+        transport=None,
+        request_compression: str = None,
+        compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+        cache=None,
+        backend: str = None,
+    ):
+        """
+        Kwargs:
+           transport (Transport): Sends the requests. Defaults to a transport
+               built on the installed HTTP library.
+           request_compression (str): Content encoding ("gzip", "deflate",
+               "br" or "zstd") used to compress large request bodies. In
+               process transports are always sent uncompressed bodies.
+           compression_threshold (int): Request bodies shorter than this
+               aren't compressed.
+           cache (NormalizedCache): Answer queries from previously fetched
+               entities where possible.
+           backend (str): HTTP library of the default transport ("httpx",
+               "aiohttp" or "requests"). It's imported on the first request.
+
+        Response compression is negotiated by the HTTP library, which
+        advertises and incrementally decodes every encoding it supports
+        (including br and zstd when brotli and zstandard are installed).
+        """
+        if request_compression is not None:
+            compression.check_encoding(request_compression)
+        if transport is not None and backend is not None:
+            raise ValueError("Pass either transport or backend, not both")
+        if backend is not None:
+            from .transport import check_backend
+
+            check_backend(backend)
         self.url = url
         self.headers = headers
         self.middleware = [mw() for mw in middleware]
+        self._transport = transport
+        self.backend = backend
+        self.request_compression = request_compression
+        self.compression_threshold = compression_threshold
+        self.cache = cache
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Thread pool shared by prefetched queries"""
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+
+                self._executor = ThreadPoolExecutor(thread_name_prefix="py2graphql")
+            return self._executor
+
+    @property
+    def transport(self):
+        with self._lock:
+            if self._transport is None:
+                from .transport import default_transport
+
+                self._transport = default_transport(self.backend)
+            return self._transport
 
     def query(self, **kwargs):
         return Query(client=self, **kwargs)
@@ -240,56 +388,149 @@ class Client(object):
     def mutation(self, **kwargs):
         return Mutation(client=self, **kwargs)
 
+    def loader(self, values, **kwargs):
+        """
+        Create a DataLoader batching node lookups made through this client.
+        See DataLoader for the options.
+        """
+        from .dataloader import DataLoader
+
+        return DataLoader(self, values, **kwargs)
+
     def pre_response(self, result_dict, root_node):
         for mw in self.middleware:
             result_dict = mw.pre_response(result_dict, root_node)
         return result_dict
 
+    def _encode_body(self, body: str):
+        """
+        Compress body if it's large enough. Returns body and request headers.
+        """
+        if (
+            self.request_compression is None
+            or len(body) < self.compression_threshold
+            or not self.transport.compress_requests
+        ):
+            return body, self.headers
+
+        headers = dict(self.headers or {})
+        headers["Content-Encoding"] = self.request_compression
+        return compression.compress(body, self.request_compression), headers
+
     def do_request(self, body):
-        if httpx:
-            return httpx.post(
-                self.url, data=body, headers=self.headers, timeout=DEFAULT_TIMEOUT
-            )
-        elif requests:
-            return requests.post(
-                self.url, body, headers=self.headers, timeout=DEFAULT_TIMEOUT
-            )
-        else:
-            raise ImportError(
-                "No HTTP client available. Please install either 'requests' or 'httpx'."
-            )
+        body, headers = self._encode_body(body)
+        return self.transport.request(self.url, body, headers, DEFAULT_TIMEOUT)
 
+    @_retry
     async def do_request_async(self, body):
-        return await do_request_async(self.url, body, self.headers)
+        body, headers = self._encode_body(body)
+        return await self.transport.request_async(
+            self.url, body, headers, DEFAULT_TIMEOUT
+        )
 
-    def fetch(self, graphql: str, variables={}):
+    def _build_body(self, graphql: str, variables):
         body = {"query": graphql}
 
         if variables:
             body["variables"] = variables
 
-        r = self.do_request(json.dumps(body))
+        return json.dumps(body)
 
+    def _parse_response(self, r):
         if r.status_code != 200:
             raise GraphQLEndpointError(
-                r.content, status_code=r.status_code, response_object=r
+                r.content, status_code=r.status_code, response_object=r.raw
             )
 
-        return json.loads(r.content)
+        return r.json()
 
-    async def fetch_async(self, graphql: str, variables={}):
-        body = {"query": graphql}
+    def _get_data(self, response_content):
+        errors = response_content.get("errors")
+        if errors is not None:
+            raise GraphQLError(response_content)
 
-        if variables:
-            body["variables"] = variables
+        return response_content.get("data", {})
 
-        r = await self.do_request_async(json.dumps(body))
+    def _fetch_data(self, query: Query, variables={}):
+        return self._get_data(self.fetch(query.to_graphql(), variables))
 
-        status_code = r.status
-        content = await r.text()
+    async def _fetch_data_async(self, query: Query, variables={}):
+        return self._get_data(await self.fetch_async(query.to_graphql(), variables))
 
-        if status_code != 200:
-            raise GraphQLEndpointError(
-                content, status_code=status_code, response_object=r
-            )
-        return json.loads(content)
+    def execute(self, query: Query, variables={}):
+        """
+        Send a query tree and return its data after running the middleware
+        """
+        root = query._get_root()
+        if self.cache is not None and self.cache.cacheable(root, variables):
+            data = self.cache.resolve(root, self._fetch_data)
+        else:
+            data = self._fetch_data(root, variables)
+        return self.pre_response(data, root_node=root)
+
+    async def execute_async(self, query: Query, variables={}):
+        root = query._get_root()
+        if self.cache is not None and self.cache.cacheable(root, variables):
+            data = await self.cache.resolve_async(root, self._fetch_data_async)
+        else:
+            data = await self._fetch_data_async(root, variables)
+        return self.pre_response(data, root_node=root)
+
+    def fetch_many(self, queries, max_workers: int = None):
+        """
+        Execute queries concurrently on a thread pool.
+
+        Results are returned in the same order as queries. A query that fails
+        gets its exception in place of a result instead of aborting the batch.
+
+        Kwargs:
+           max_workers (int): Size of the thread pool.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.execute, query) for query in queries]
+            return [_result_or_exception(future) for future in futures]
+
+    def fetch_as_completed(self, queries, max_workers: int = None):
+        """
+        Like fetch_many, but returns an iterator of (query, result) pairs in
+        the order they complete.
+
+        Every query is submitted right away. Queries that haven't started
+        yet are dropped when the iterator is closed early.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {executor.submit(self.execute, query): query for query in queries}
+        return self._iter_completed(executor, futures)
+
+    def _iter_completed(self, executor, futures: dict):
+        from concurrent.futures import as_completed
+
+        try:
+            for future in as_completed(futures):
+                yield futures[future], _result_or_exception(future)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def fetch(self, graphql: str, variables={}):
+        r = self.do_request(self._build_body(graphql, variables))
+        return self._parse_response(r)
+
+    async def fetch_async(self, graphql: str, variables={}):
+        r = await self.do_request_async(self._build_body(graphql, variables))
+        return self._parse_response(r)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._transport is not None:
+            self._transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,165 @@
+import asyncio
+from typing import List
+
+from .exception import BatchLoadError
+from .exception import GraphQLError
+
+
+class DataLoader(object):
+    """
+    Batches node lookups made within one event loop tick into a single query.
+
+    Every load() call made before the event loop gets round to the next
+    callback is sent as one query, either as aliased fields:
+
+        query {
+          n0: node(id: "a") {...}
+          n1: node(id: "b") {...}
+        }
+
+    or, when batch_field is given, as one list field:
+
+        query {
+          nodes(ids: ["a", "b"]) {...}
+        }
+
+    Results are memoized per key, so create one DataLoader per request.
+    Results are the raw node dicts; the client's middleware isn't applied.
+    """
+
+    def __init__(
+        self,
+        client,
+        values,
+        field: str = "node",
+        id_argument: str = "id",
+        batch_field: str = None,
+        batch_argument: str = "ids",
+        on: str = None,
+        max_batch_size: int = None,
+    ):
+        """
+        Args:
+           client (Client): Client used for sending queries.
+           values (list): Fields to select on each node.
+
+        Kwargs:
+           field (str): Field looking up a single node.
+           id_argument (str): Argument of field taking the key.
+           batch_field (str): Field looking up a list of nodes. Used instead
+               of aliased fields when given.
+           batch_argument (str): Argument of batch_field taking the keys.
+           on (str): Select values in an inline fragment on this type.
+           max_batch_size (int): Split larger batches into several queries.
+        """
+        self.client = client
+        self.values = list(values)
+        self.field = field
+        self.id_argument = id_argument
+        self.batch_field = batch_field
+        self.batch_argument = batch_argument
+        self.on = on
+        self.max_batch_size = max_batch_size
+        self._cache: dict = {}
+        self._queue: List = []
+        # The event loop only keeps weak references to tasks
+        self._tasks: set = set()
+
+    def load(self, key):
+        """
+        Returns a future resolving to the node with this key
+        """
+        future = self._cache.get(key)
+        if future is not None:
+            return future
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._cache[key] = future
+        self._queue.append((key, future))
+        if len(self._queue) == 1:
+            loop.call_soon(self._dispatch)
+        return future
+
+    def load_many(self, keys):
+        return asyncio.gather(*[self.load(key) for key in keys])
+
+    def prime(self, key, value):
+        """Put a node in the cache, unless key is already loaded"""
+        if key not in self._cache:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            self._cache[key] = future
+
+    def clear(self, key=None):
+        """Forget one key, or everything if no key is given"""
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def _dispatch(self):
+        queue, self._queue = self._queue, []
+        size = self.max_batch_size or len(queue)
+        for i in range(0, len(queue), size):
+            task = asyncio.ensure_future(self._load_batch(queue[i : i + size]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _select(self, node):
+        if self.on:
+            node = node._field("... on {}".format(self.on))
+        node.values(*self.values)
+
+    def _build_query(self, keys):
+        query = self.client.query()
+        if self.batch_field:
+            node = query._field(self.batch_field)(**{self.batch_argument: keys})
+            self._select(node)
+        else:
+            for i, key in enumerate(keys):
+                node = query._field(self.field, alias="n{}".format(i))
+                self._select(node(**{self.id_argument: key}))
+        return query
+
+    def _reject(self, key, future, exception):
+        # Failed keys aren't memoized, so they can be retried
+        if self._cache.get(key) is future:
+            del self._cache[key]
+        if not future.done():
+            future.set_exception(exception)
+
+    async def _load_batch(self, batch):
+        keys = [key for key, _ in batch]
+        try:
+            response = await self.client.fetch_async(
+                self._build_query(keys).to_graphql()
+            )
+        except Exception as e:
+            for key, future in batch:
+                self._reject(key, future, e)
+            return
+
+        data = response.get("data") or {}
+        if self.batch_field:
+            nodes = data.get(self.batch_field)
+            if nodes is None:
+                nodes = [None] * len(keys)
+            elif len(nodes) != len(keys):
+                # Nodes can't be matched up with keys
+                e = BatchLoadError(
+                    "{} returned {} nodes for {} keys".format(
+                        self.batch_field, len(nodes), len(keys)
+                    )
+                )
+                for key, future in batch:
+                    self._reject(key, future, e)
+                return
+        else:
+            nodes = [data.get("n{}".format(i)) for i in range(len(keys))]
+
+        for (key, future), node in zip(batch, nodes):
+            if node is None and response.get("errors") is not None:
+                self._reject(key, future, GraphQLError(response))
+            elif not future.done():
+                future.set_result(node)
@@ -0,0 +1,142 @@
+import enum
+import numbers
+import threading
+from collections import OrderedDict
+
+from .types import Aliased
+from .types import Literal
+from .types import Variable
+
+
+DEFAULT_DOCUMENT_CACHE_SIZE = 1024
+# Larger documents (eg. carrying big text arguments) are rarely sent twice
+DEFAULT_MAX_DOCUMENT_SIZE = 64 * 1024
+
+
+class Fingerprint(object):
+    """
+    Hashable structural identity of a Query tree.
+
+    Two trees with the same fingerprint render to the same document.
+    """
+
+    __slots__ = ("key", "_hash")
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self._hash = hash(key)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Fingerprint):
+            return NotImplemented
+        return self._hash == other._hash and self.key == other.key
+
+    def __repr__(self):
+        return "<Fingerprint {:x}>".format(self._hash & 0xFFFFFFFFFFFFFFFF)
+
+
+# Scalars that need a type tag, as eg. True == 1 but they serialize
+# differently
+_TAGGED_SCALARS = frozenset([int, bool, type(None)])
+
+
+def freeze_arg(arg):
+    """
+    Hashable version of an argument. Raises TypeError for unhashable values.
+    """
+    arg_type = type(arg)
+    if arg_type is str:
+        return arg
+    elif arg_type in _TAGGED_SCALARS:
+        return (arg_type, arg)
+    elif isinstance(arg, numbers.Number):
+        # Frozen as rendered, as equal numbers may not render the same (eg.
+        # 0.0 and -0.0, or Decimal("1.0") and Decimal("1.00"))
+        return (arg_type, str(arg))
+    elif isinstance(arg, dict):
+        return (dict, freeze_args(arg))
+    elif isinstance(arg, list):
+        return (list, tuple(map(freeze_arg, arg)))
+    elif isinstance(arg, (Literal, Variable)):
+        return (type(arg), arg.name)
+    elif isinstance(arg, enum.Enum):
+        return (enum.Enum, arg.name)
+    return (arg_type, arg)
+
+
+def freeze_args(args: dict):
+    return tuple([(k, freeze_arg(v)) for k, v in args.items()])
+
+
+def has_mutable_args(args: dict):
+    """Whether args hold containers that can change after being passed"""
+    return any(isinstance(v, (dict, list)) for v in args.values())
+
+
+def freeze_value(value):
+    if type(value) is str:
+        return value
+    elif isinstance(value, Aliased):
+        return (Aliased, value.name, value.alias)
+    return value
+
+
+class DocumentCache(object):
+    """
+    Thread safe LRU cache of rendered documents
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_DOCUMENT_CACHE_SIZE,
+        max_document_size: int = DEFAULT_MAX_DOCUMENT_SIZE,
+    ):
+        """
+        Kwargs:
+           maxsize (int): Least recently used documents beyond this are
+               evicted.
+           max_document_size (int): Longer documents aren't cached.
+        """
+        self.maxsize = maxsize
+        self.max_document_size = max_document_size
+        self._documents: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+            return document
+
+    def set(self, key, document: str):
+        if len(document) > self.max_document_size:
+            return
+        with self._lock:
+            self._documents[key] = document
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.maxsize:
+                self._documents.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+    def __len__(self):
+        return len(self._documents)
+
+
+# Process wide cache of documents rendered by Query.to_graphql
+document_cache = DocumentCache()
+
+
+def fingerprint(query):
+    """
+    Fingerprint of the whole tree query belongs to.
+    """
+    return query._get_root()._get_fingerprint()
@@ -24,5 +24,9 @@ class GraphQLEndpointError(Exception):
         super().__init__(response)
 
 
+class BatchLoadError(Exception):
+    """Batch field didn't return one node per key"""
+
+
 class UnserializableTypeError(Exception):
     pass
@@ -0,0 +1,218 @@
+import json
+import os
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+
+
+class JSONLSink(object):
+    """
+    Appends items to a JSON lines file.
+
+    The position is the file size, so resuming truncates anything written
+    after the last checkpoint.
+    """
+
+    extension = "jsonl"
+
+    def __init__(self, path: str, position=None):
+        self._file = open(path, "ab")
+        self._file.truncate(position or 0)
+        self._file.seek(position or 0)
+
+    def write(self, items):
+        self._file.write(
+            b"".join(json.dumps(item).encode("utf-8") + b"\n" for item in items)
+        )
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def position(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink(object):
+    """
+    Writes each page to its own Parquet file. Requires pyarrow.
+
+    The position is the number of pages written, so resuming overwrites any
+    page written after the last checkpoint.
+    """
+
+    extension = "parquet"
+
+    def __init__(self, path: str, position=None):
+        try:
+            import pyarrow  # type: ignore
+            import pyarrow.parquet  # type: ignore
+        except ImportError:
+            raise ImportError("pyarrow is required for Parquet export")
+        self._pyarrow = pyarrow
+        self._path = path
+        self._pages = position or 0
+
+    def write(self, items):
+        table = self._pyarrow.Table.from_pylist(list(items))
+        self._pyarrow.parquet.write_table(
+            table, "{}-{:06d}.parquet".format(self._path, self._pages)
+        )
+        self._pages += 1
+
+    def position(self):
+        return self._pages
+
+    def close(self):
+        pass
+
+
+SINKS = {
+    "jsonl": JSONLSink,
+    "parquet": ParquetSink,
+}
+
+
+def _read_checkpoint(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_checkpoint(path: str, checkpoint: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# Client of the current worker process, created by _init_worker
+_worker_client = None
+
+
+def _init_worker(client_factory):
+    global _worker_client
+    _worker_client = client_factory()
+
+
+def _export_shard(shard, path: str, sink_class, build_query, extract):
+    checkpoint_path = path + ".checkpoint"
+    checkpoint = _read_checkpoint(checkpoint_path) or {
+        "cursor": None,
+        "count": 0,
+        "position": None,
+        "done": False,
+    }
+    if checkpoint["done"]:
+        return checkpoint["count"]
+
+    sink = sink_class(
+        "{}.{}".format(path, sink_class.extension), checkpoint["position"]
+    )
+    try:
+        while True:
+            query = build_query(_worker_client, shard, checkpoint["cursor"])
+            items, cursor = extract(query.fetch(), shard)
+            sink.write(items)
+            checkpoint = {
+                "cursor": cursor,
+                "count": checkpoint["count"] + len(items),
+                "position": sink.position(),
+                "done": cursor is None,
+            }
+            _write_checkpoint(checkpoint_path, checkpoint)
+            if cursor is None:
+                return checkpoint["count"]
+    finally:
+        sink.close()
+
+
+class ShardedExport(object):
+    """
+    Crawl a paginated query across worker processes and stream the results
+    to disk.
+
+    The work is split into shards (eg. ID ranges or cursor ranges). Each
+    worker process holds its own Client and pages through whole shards,
+    writing every page to the shard's sink and then checkpointing its
+    cursor. Running an interrupted export again resumes each shard from its
+    last checkpoint.
+    """
+
+    def __init__(
+        self,
+        client_factory,
+        build_query,
+        extract,
+        shards,
+        output_dir: str,
+        sink="jsonl",
+        max_workers: int = None,
+    ):
+        """
+        Args:
+           client_factory: Called once in each worker to create its Client.
+           build_query: Called as build_query(client, shard, cursor) to build
+               the Query for a page. cursor is None for the first page.
+           extract: Called as extract(data, shard) with the fetched data.
+               Returns (items, next_cursor). A next_cursor of None ends the
+               shard.
+           shards (list): Picklable description of each shard.
+           output_dir (str): Directory for output and checkpoint files.
+
+        Kwargs:
+           sink: "jsonl", "parquet" or a sink class.
+           max_workers (int): Number of worker processes.
+
+        All callables are sent to worker processes, so they must be picklable
+        (ie. module level functions).
+        """
+        self.client_factory = client_factory
+        self.build_query = build_query
+        self.extract = extract
+        self.shards = list(shards)
+        self.output_dir = output_dir
+        self.sink_class = SINKS[sink] if isinstance(sink, str) else sink
+        self.max_workers = max_workers
+
+    def shard_path(self, index: int):
+        return os.path.join(self.output_dir, "shard-{:05d}".format(index))
+
+    def run(self):
+        """
+        Export every shard. Returns the number of items in each shard.
+
+        Shards that fail don't stop the others. Once all shards have finished
+        the first error is raised, and running again resumes the failed ones.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        counts = [None] * len(self.shards)
+        errors = []
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(self.client_factory,),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    _export_shard,
+                    shard,
+                    self.shard_path(index),
+                    self.sink_class,
+                    self.build_query,
+                    self.extract,
+                ): index
+                for index, shard in enumerate(self.shards)
+            }
+            for future in as_completed(futures):
+                try:
+                    counts[futures[future]] = future.result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+        return counts
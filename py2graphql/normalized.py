@@ -0,0 +1,408 @@
+import threading
+from collections import OrderedDict
+
+from .core import Query
+from .serialization import serialize_arg
+from .types import Aliased
+
+
+ROOT_QUERY = "ROOT_QUERY"
+DEFAULT_MAX_ENTITIES = 10000
+
+
+class Reference(object):
+    """
+    Pointer from a stored field to an entity
+    """
+
+    __slots__ = ("key",)
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def __eq__(self, other):
+        return isinstance(other, Reference) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return "Reference({!r})".format(self.key)
+
+
+def _leaf_keys(value):
+    """Returns the field name and response key of a leaf value"""
+    if isinstance(value, Aliased):
+        return value.name, value.alias
+    return value, value
+
+
+def _is_fragment(node: Query):
+    return node._operation_type.startswith("...")
+
+
+def _fragment_type(node: Query):
+    # "... on Repository" -> "Repository"
+    parts = node._operation_type.split()
+    return parts[-1] if len(parts) == 3 else None
+
+
+def _matches_fragment(node: Query, obj: dict):
+    typename = obj.get("__typename")
+    return typename is None or typename == _fragment_type(node)
+
+
+def _storage_key(node: Query):
+    if not node._call_args:
+        return node._operation_type
+    return "{}({})".format(
+        node._operation_type,
+        ", ".join(
+            "{}: {}".format(k, serialize_arg(v))
+            for k, v in sorted(node._call_args.items())
+        ),
+    )
+
+
+def _response_key(node: Query):
+    return node._alias or node._operation_type
+
+
+def _shell(node: Query):
+    """Copy of node without its selections"""
+    shell = Query(operation_type=node._operation_type, alias=node._alias)
+    if node._call_args:
+        shell(**node._call_args)
+    return shell
+
+
+def _adopt(parent: Query, child: Query):
+    child._parent = parent
+    parent._nodes.append(child)
+    parent._changed()
+    if child._volatile:
+        parent._mark_volatile()
+
+
+def _copy_selections(node: Query, target: Query):
+    if node._values_to_show:
+        target.values(*node._values_to_show)
+    for child in node._nodes:
+        child_copy = _shell(child)
+        _copy_selections(child, child_copy)
+        _adopt(target, child_copy)
+
+
+def _is_empty(node: Query):
+    return not node._nodes and not node._values_to_show
+
+
+class NormalizedCache(object):
+    """
+    Stores responses as entities keyed by __typename and id, so queries can
+    be answered from whatever previous queries fetched.
+
+    Queries sent through a Client with a NormalizedCache get __typename
+    added to every selection. Objects in their responses that have the key
+    fields (ie. where the query selected them) are stored as entities, other
+    objects are stored embedded in their parent. A later query is answered
+    from the store when possible, otherwise only the parts that are missing
+    are sent. Mutation results update the entities they return.
+
+    Queries with variables bypass the cache.
+    """
+
+    def __init__(
+        self,
+        key_fields=("id",),
+        max_entities: int = DEFAULT_MAX_ENTITIES,
+        invalidate_root_on_mutation: bool = False,
+    ):
+        """
+        Kwargs:
+           key_fields (tuple): Fields identifying an entity, along with its
+               __typename. Only objects whose response has all of them are
+               stored as entities.
+           max_entities (int): Least recently used entities beyond this are
+               evicted.
+           invalidate_root_on_mutation (bool): Forget all root query fields
+               (eg. lists that a mutation may have added to) after a
+               mutation. Entities are kept.
+        """
+        self.key_fields = tuple(key_fields)
+        self.max_entities = max_entities
+        self.invalidate_root_on_mutation = invalidate_root_on_mutation
+        self._entities: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+
+    def identify(self, obj: dict):
+        """Returns the entity key of a response object, or None"""
+        typename = obj.get("__typename")
+        if typename is None:
+            return None
+        keys = [obj.get(field) for field in self.key_fields]
+        if any(key is None for key in keys):
+            return None
+        return ":".join([typename] + [str(key) for key in keys])
+
+    def get(self, key: str):
+        """Returns the stored record of an entity, or None"""
+        with self._lock:
+            return self._entities.get(key)
+
+    def evict(self, key: str):
+        with self._lock:
+            self._entities.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entities.clear()
+
+    def __len__(self):
+        return len(self._entities)
+
+    def cacheable(self, root: Query, variables):
+        return not variables and not root._operation_variables
+
+    def _is_mutation(self, root: Query):
+        return root._operation_type == "mutation"
+
+    # Writing
+
+    def _touch(self, key: str):
+        if key in self._entities:
+            self._entities.move_to_end(key)
+        else:
+            self._entities[key] = {}
+        return self._entities[key]
+
+    def _evict_overflow(self):
+        overflow = len(self._entities) - self.max_entities
+        if ROOT_QUERY in self._entities:
+            overflow -= 1
+        if overflow > 0:
+            keys = [key for key in self._entities if key != ROOT_QUERY]
+            for key in keys[:overflow]:
+                del self._entities[key]
+
+    def _write_selection(self, node: Query, obj: dict, record: dict):
+        for value in node._values_to_show:
+            name, key = _leaf_keys(value)
+            if key in obj:
+                record[name] = obj[key]
+        for child in node._nodes:
+            if _is_fragment(child):
+                if _matches_fragment(child, obj):
+                    self._write_selection(child, obj, record)
+                continue
+            key = _response_key(child)
+            if key in obj:
+                storage_key = _storage_key(child)
+                record[storage_key] = self._write_value(
+                    child, obj[key], record.get(storage_key)
+                )
+
+    def _write_value(self, node: Query, value, existing=None):
+        if isinstance(value, list):
+            return [self._write_value(node, item) for item in value]
+        elif isinstance(value, dict):
+            key = self.identify(value)
+            if key is None:
+                # Embedded object, merged with what's already stored
+                record = existing if isinstance(existing, dict) else {}
+                self._write_selection(node, value, record)
+                return record
+            self._write_selection(node, value, self._touch(key))
+            return Reference(key)
+        return value
+
+    def write(self, root: Query, data: dict):
+        """
+        Store the data returned for root
+        """
+        with self._lock:
+            if self._is_mutation(root):
+                self._write_selection(root, data, {})
+                if self.invalidate_root_on_mutation:
+                    self._entities.pop(ROOT_QUERY, None)
+            else:
+                self._write_selection(root, data, self._touch(ROOT_QUERY))
+            self._evict_overflow()
+
+    # Reading
+
+    def _read_selection(self, node: Query, record: dict, missing: Query):
+        data = {}
+        for value in node._values_to_show:
+            name, key = _leaf_keys(value)
+            if name in record:
+                data[key] = record[name]
+            else:
+                missing.values(value)
+        for child in node._nodes:
+            child_missing = _shell(child)
+            if _is_fragment(child):
+                if _matches_fragment(child, record):
+                    data.update(self._read_selection(child, record, child_missing))
+            else:
+                storage_key = _storage_key(child)
+                if storage_key in record:
+                    data[_response_key(child)] = self._read_value(
+                        child, record[storage_key], child_missing
+                    )
+                else:
+                    _copy_selections(child, child_missing)
+            if not _is_empty(child_missing):
+                _adopt(missing, child_missing)
+        return data
+
+    def _read_value(self, node: Query, value, missing: Query):
+        if isinstance(value, list):
+            items = []
+            for item in value:
+                item_missing = _shell(node)
+                items.append(self._read_value(node, item, item_missing))
+                if not _is_empty(item_missing):
+                    # Refetch the whole selection rather than merging the
+                    # missing parts of every item
+                    _copy_selections(node, missing)
+                    if isinstance(item, Reference):
+                        self._select_key_fields(missing)
+                    return None
+            return items
+        elif isinstance(value, Reference):
+            record = self._entities.get(value.key)
+            if record is None:
+                _copy_selections(node, missing)
+                self._select_key_fields(missing)
+                return None
+            self._entities.move_to_end(value.key)
+            data = self._read_selection(node, record, missing)
+            if not _is_empty(missing):
+                self._select_key_fields(missing)
+            return data
+        elif isinstance(value, dict):
+            return self._read_selection(node, value, missing)
+        return value
+
+    def _select(self, node: Query, fields):
+        selected = set(_leaf_keys(value)[0] for value in node._values_to_show)
+        fields = [field for field in fields if field not in selected]
+        if fields:
+            node.values(*fields)
+
+    def _select_key_fields(self, node: Query):
+        """
+        Select the key fields of a stored entity being fetched again, so the
+        response is merged into it
+        """
+        self._select(node, self.key_fields)
+
+    def _add_typename(self, node: Query):
+        # Key fields aren't added, as not every type has them
+        for child in node._nodes:
+            if not _is_fragment(child) and not _is_empty(child):
+                self._select(child, ("__typename",))
+            self._add_typename(child)
+
+    def _empty_root(self, root: Query):
+        return type(root)(
+            operation_type=root._operation_type,
+            client=root._client,
+            operation_name=root._operation_name,
+            operation_variables=root._operation_variables,
+        )
+
+    def with_typename(self, root: Query):
+        """
+        Copy of root with __typename added to every selection
+        """
+        query = self._empty_root(root)
+        _copy_selections(root, query)
+        self._add_typename(query)
+        return query
+
+    def diff(self, root: Query):
+        """
+        Read root from the store.
+
+        Returns (data, missing). missing is None when the store has
+        everything, otherwise it's the query for the parts that aren't
+        stored, with __typename added.
+        """
+        with self._lock:
+            missing = self._empty_root(root)
+            data = self._read_selection(
+                root, self._entities.get(ROOT_QUERY, {}), missing
+            )
+            if _is_empty(missing):
+                return data, None
+            self._add_typename(missing)
+            return data, missing
+
+    def project(self, node: Query, obj):
+        """
+        Strip a response down to the fields node selected
+        """
+        if isinstance(obj, list):
+            return [self.project(node, item) for item in obj]
+        elif not isinstance(obj, dict):
+            return obj
+        data = {}
+        for value in node._values_to_show:
+            key = _leaf_keys(value)[1]
+            if key in obj:
+                data[key] = obj[key]
+        for child in node._nodes:
+            if _is_fragment(child):
+                if _matches_fragment(child, obj):
+                    data.update(self.project(child, obj))
+                continue
+            key = _response_key(child)
+            if key in obj:
+                data[key] = self.project(child, obj[key])
+        return data
+
+    def resolve(self, root: Query, fetch):
+        """
+        Answer root from the store, calling fetch(query) to get the data of
+        whatever is missing
+        """
+        if self._is_mutation(root):
+            query = self.with_typename(root)
+            data = fetch(query)
+            self.write(query, data)
+            return self.project(root, data)
+
+        data, missing = self.diff(root)
+        if missing is None:
+            return data
+        self.write(missing, fetch(missing))
+        data, missing = self.diff(root)
+        if missing is None:
+            return data
+
+        # The response didn't have everything (eg. a field the server
+        # omitted), so fall back to asking for the whole query
+        data = fetch(root)
+        self.write(root, data)
+        return data
+
+    async def resolve_async(self, root: Query, fetch_async):
+        if self._is_mutation(root):
+            query = self.with_typename(root)
+            data = await fetch_async(query)
+            self.write(query, data)
+            return self.project(root, data)
+
+        data, missing = self.diff(root)
+        if missing is None:
+            return data
+        self.write(missing, await fetch_async(missing))
+        data, missing = self.diff(root)
+        if missing is None:
+            return data
+
+        data = await fetch_async(root)
+        self.write(root, data)
+        return data
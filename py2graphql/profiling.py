@@ -0,0 +1,181 @@
+import contextlib
+import sys
+import time
+import tracemalloc
+
+from .serialization import serialize_arg
+
+
+# Profile collecting stats, if profiling is on
+active = None
+
+SORT_KEYS = (
+    "path",
+    "nodes",
+    "renders",
+    "render_time",
+    "serialize_time",
+    "arg_bytes",
+    "allocated",
+)
+
+
+def _path(node):
+    names = []
+    while node is not None:
+        names.append(node._operation_type)
+        node = node._parent
+    return ".".join(reversed(names))
+
+
+class SubtreeStats(object):
+    """
+    Stats of all Query nodes found at one path (eg. query.repository.owner)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Nodes built
+        self.nodes = 0
+        # Times the subtree was rendered
+        self.renders = 0
+        # Seconds spent rendering the subtree, including its children
+        self.render_time = 0.0
+        # Seconds spent serializing the node's arguments
+        self.serialize_time = 0.0
+        # Size of the node's serialized arguments
+        self.arg_bytes = 0
+        # Bytes allocated (and still alive) while rendering the subtree
+        self.allocated = 0
+
+
+class Profile(object):
+    """
+    Stats collected by profile()
+    """
+
+    def __init__(self, trace_allocations: bool = True):
+        self.trace_allocations = trace_allocations
+        self.stats: dict = {}
+        # Totals reported by tracemalloc over the whole profile
+        self.allocated = 0
+        self.peak_allocated = 0
+
+    def _get(self, node):
+        path = _path(node)
+        stats = self.stats.get(path)
+        if stats is None:
+            stats = self.stats[path] = SubtreeStats(path)
+        return stats
+
+    def _traced(self):
+        if self.trace_allocations and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return 0
+
+    def record_node(self, node):
+        self._get(node).nodes += 1
+
+    def record_args(self, node, args: dict):
+        stats = self._get(node)
+        start = time.perf_counter()
+        try:
+            size = sum(len(k) + len(serialize_arg(v)) for k, v in args.items())
+        except Exception:
+            # Reported when the query is rendered
+            return
+        stats.serialize_time += time.perf_counter() - start
+        stats.arg_bytes += size
+
+    def record_render(self, node, render, *args):
+        stats = self._get(node)
+        traced = self._traced()
+        start = time.perf_counter()
+        try:
+            return render(*args)
+        finally:
+            stats.render_time += time.perf_counter() - start
+            stats.allocated += self._traced() - traced
+            stats.renders += 1
+
+    def sorted_stats(self, sort: str = "render_time"):
+        if sort not in SORT_KEYS:
+            raise ValueError("sort must be one of {}".format(", ".join(SORT_KEYS)))
+        return sorted(
+            self.stats.values(),
+            key=lambda stats: getattr(stats, sort),
+            reverse=sort != "path",
+        )
+
+    def report(self, sort: str = "render_time", limit: int = None):
+        """
+        Table of the stats of every path, sorted by sort
+        """
+        lines = [
+            "py2graphql profile: {} paths, {} bytes allocated, {} bytes peak".format(
+                len(self.stats), self.allocated, self.peak_allocated
+            ),
+            "{:>8} {:>8} {:>12} {:>14} {:>10} {:>10}  {}".format(
+                "nodes",
+                "renders",
+                "render (ms)",
+                "serialize (ms)",
+                "arg bytes",
+                "allocated",
+                "path",
+            ),
+        ]
+        for stats in self.sorted_stats(sort)[:limit]:
+            lines.append(
+                "{:>8} {:>8} {:>12.3f} {:>14.3f} {:>10} {:>10}  {}".format(
+                    stats.nodes,
+                    stats.renders,
+                    stats.render_time * 1000,
+                    stats.serialize_time * 1000,
+                    stats.arg_bytes,
+                    stats.allocated,
+                    stats.path,
+                )
+            )
+        return "\n".join(lines)
+
+    def dump(self, file=None, sort: str = "render_time", limit: int = None):
+        print(self.report(sort=sort, limit=limit), file=file or sys.stderr)
+
+
+@contextlib.contextmanager
+def profile(trace_allocations: bool = True):
+    """
+    Profile building and rendering of every Query in the process.
+
+        with py2graphql.profile() as prof:
+            build_and_render_queries()
+        prof.dump(sort="render_time")
+
+    Rendered documents aren't served from the document cache while
+    profiling, so every render is measured.
+
+    Kwargs:
+       trace_allocations (bool): Track allocations with tracemalloc.
+    """
+    global active
+
+    prof = Profile(trace_allocations=trace_allocations)
+    started_tracing = trace_allocations and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    baseline = prof._traced()
+    if trace_allocations:
+        tracemalloc.reset_peak()
+
+    previous, active = active, prof
+    try:
+        yield prof
+    finally:
+        active = previous
+        if trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            prof.allocated = current - baseline
+            prof.peak_allocated = peak - baseline
+        if started_tracing:
+            tracemalloc.stop()
@@ -0,0 +1,481 @@
+import asyncio
+import atexit
+import concurrent.futures
+import importlib.util
+import io
+import json
+import sys
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+
+# HTTP libraries that can back the default transport, preferred first. They
+# are only imported once a transport using them is created.
+BACKENDS = ("httpx", "aiohttp", "requests")
+
+# Seconds to wait for sessions to close when the interpreter exits
+SHUTDOWN_TIMEOUT = 5
+
+
+class Response(object):
+    """
+    HTTP response as seen by the Client, independent of the HTTP library
+    """
+
+    def __init__(self, status_code: int, content, raw=None, payload=None):
+        """
+        Args:
+           status_code (int): HTTP status code.
+           content (str or bytes): Response body.
+           raw: Response object of the underlying HTTP library.
+           payload (dict): Already decoded body, skips JSON decoding.
+        """
+        self.status_code = status_code
+        self.content = content
+        self.raw = raw
+        self.payload = payload
+
+    def json(self):
+        if self.payload is not None:
+            return self.payload
+        return json.loads(self.content)
+
+
+class Transport(object):
+    """
+    Sends a serialized GraphQL request body and returns a Response.
+
+    Subclass this to plug a custom transport into Client.
+    """
+
+    # Whether the Client may send compressed request bodies
+    compress_requests = True
+
+    def request(self, url: str, body: str, headers: dict, timeout: float):
+        """
+        body is bytes instead of str when the Client compressed it.
+        """
+        raise NotImplementedError
+
+    async def request_async(self, url: str, body: str, headers: dict, timeout: float):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class EventLoopThread(object):
+    """
+    An asyncio event loop running forever on a daemon thread
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # Futures of coroutines started with submit()
+        self._pending: set = set()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="py2graphql-event-loop",
+                    daemon=True,
+                )
+                self._thread.start()
+            return self._loop
+
+    @property
+    def running(self):
+        return self._loop is not None
+
+    def run(self, coro):
+        """Run coro on the loop and block until it's done"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def run_async(self, coro):
+        """Run coro on the loop and await it from another event loop"""
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(coro, self.loop)
+        )
+
+    def submit(self, coro):
+        """Start coro on the loop without waiting for it"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return future
+
+    def stop(self, timeout: float = None):
+        """Wait for submitted coroutines, then stop the loop"""
+        concurrent.futures.wait(list(self._pending), timeout=timeout)
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+
+# Background event loop shared by every AsyncTransport
+event_loop_thread = EventLoopThread()
+
+# Transports with an open session, closed when the interpreter exits
+_open_transports: weakref.WeakSet = weakref.WeakSet()
+
+
+def _close_session(loop_thread: EventLoopThread, aclose):
+    # Called when the transport is garbage collected, possibly on the loop
+    # itself, so don't wait for the session to close
+    loop_thread.submit(aclose())
+
+
+@atexit.register
+def _shutdown():
+    for transport in list(_open_transports):
+        transport.close()
+    event_loop_thread.stop(timeout=SHUTDOWN_TIMEOUT)
+
+
+class AsyncTransport(Transport):
+    """
+    Transport with an async core.
+
+    Requests always run on one background event loop, shared by every
+    transport, so the sync and async paths share a single loop-bound session
+    and its connection pool. The session is closed by close(), or when the
+    transport is garbage collected.
+    """
+
+    def __init__(self):
+        self._loop_thread = event_loop_thread
+        self._finalizer = None
+
+    def _opened(self, aclose):
+        """
+        Register the coroutine function closing a session send() just opened
+        """
+        self._finalizer = weakref.finalize(
+            self, _close_session, self._loop_thread, aclose
+        )
+        # _shutdown closes it instead, waiting for it to be done
+        self._finalizer.atexit = False
+        _open_transports.add(self)
+
+    async def send(self, url: str, body: str, headers: dict, timeout: float):
+        """Send the request. Always runs on the background event loop."""
+        raise NotImplementedError
+
+    async def aclose(self):
+        """Release the session. Always runs on the background event loop."""
+        pass
+
+    def request(self, url: str, body: str, headers: dict, timeout: float):
+        return self._loop_thread.run(self.send(url, body, headers, timeout))
+
+    async def request_async(self, url: str, body: str, headers: dict, timeout: float):
+        return await self._loop_thread.run_async(self.send(url, body, headers, timeout))
+
+    def close(self):
+        if self._finalizer is not None and self._finalizer.detach():
+            self._loop_thread.run(self.aclose())
+        self._finalizer = None
+        _open_transports.discard(self)
+
+
+class HttpxTransport(AsyncTransport):
+    def __init__(self, **client_kwargs):
+        """
+        Kwargs:
+           client_kwargs: Passed on to httpx.AsyncClient.
+        """
+        import httpx
+
+        super().__init__()
+        self._httpx = httpx
+        self._client_kwargs = client_kwargs
+        self._client = None
+
+    async def send(self, url: str, body: str, headers: dict, timeout: float):
+        if self._client is None:
+            self._client = self._httpx.AsyncClient(**self._client_kwargs)
+            self._opened(self._client.aclose)
+        r = await self._client.post(url, content=body, headers=headers, timeout=timeout)
+        return Response(r.status_code, r.content, raw=r)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class AiohttpTransport(AsyncTransport):
+    def __init__(self, **session_kwargs):
+        """
+        Kwargs:
+           session_kwargs: Passed on to aiohttp.ClientSession.
+        """
+        import aiohttp
+
+        super().__init__()
+        self._aiohttp = aiohttp
+        self._session_kwargs = session_kwargs
+        self._session = None
+
+    async def send(self, url: str, body: str, headers: dict, timeout: float):
+        if self._session is None:
+            self._session = self._aiohttp.ClientSession(**self._session_kwargs)
+            self._opened(self._session.close)
+        async with self._session.post(
+            url,
+            data=body,
+            headers=headers,
+            timeout=self._aiohttp.ClientTimeout(total=timeout),
+        ) as r:
+            content = await r.text()
+            return Response(r.status, content, raw=r)
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class RequestsTransport(Transport):
+    """
+    Transport backed by a pooled requests.Session.
+
+    requests has no async API, so async requests run in the default executor.
+    """
+
+    def __init__(self, session=None):
+        if session is None:
+            import requests
+
+            session = requests.Session()
+        self.session = session
+
+    def request(self, url: str, body: str, headers: dict, timeout: float):
+        r = self.session.post(url, body, headers=headers, timeout=timeout)
+        return Response(r.status_code, r.content, raw=r)
+
+    async def request_async(self, url: str, body: str, headers: dict, timeout: float):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.request, url, body, headers, timeout
+        )
+
+    def close(self):
+        self.session.close()
+
+
+def _encode(body):
+    return body if isinstance(body, bytes) else body.encode("utf-8")
+
+
+def _request_headers(headers: dict):
+    headers = {k.lower(): v for k, v in (headers or {}).items()}
+    headers.setdefault("content-type", "application/json")
+    return headers
+
+
+class ASGITransport(AsyncTransport):
+    """
+    Dispatches requests straight into an in-process ASGI application.
+
+    Async requests run the app on the caller's event loop. Sync requests run
+    it on the transport's background event loop.
+    """
+
+    compress_requests = False
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+
+    async def send(self, url: str, body: str, headers: dict, timeout: float):
+        parts = urlsplit(url)
+        request_body = _encode(body)
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": parts.scheme or "http",
+            "path": parts.path or "/",
+            "raw_path": (parts.path or "/").encode("utf-8"),
+            "query_string": parts.query.encode("utf-8"),
+            "root_path": "",
+            "headers": [
+                (k.encode("latin-1"), str(v).encode("latin-1"))
+                for k, v in _request_headers(headers).items()
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": (parts.hostname or "localhost", parts.port or 80),
+        }
+        messages = [{"type": "http.request", "body": request_body, "more_body": False}]
+        response = {"status": None, "body": []}
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+
+        await asyncio.wait_for(self.app(scope, receive, send), timeout)
+        return Response(response["status"], b"".join(response["body"]))
+
+    async def request_async(self, url: str, body: str, headers: dict, timeout: float):
+        return await self.send(url, body, headers, timeout)
+
+
+class WSGITransport(Transport):
+    """
+    Dispatches requests straight into an in-process WSGI application.
+
+    WSGI apps block, so async requests run in the default executor.
+    """
+
+    compress_requests = False
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, url: str, body: str, headers: dict, timeout: float):
+        parts = urlsplit(url)
+        request_body = _encode(body)
+        environ = {
+            "REQUEST_METHOD": "POST",
+            "SCRIPT_NAME": "",
+            "PATH_INFO": parts.path or "/",
+            "QUERY_STRING": parts.query,
+            "SERVER_NAME": parts.hostname or "localhost",
+            "SERVER_PORT": str(parts.port or 80),
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "CONTENT_LENGTH": str(len(request_body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": parts.scheme or "http",
+            "wsgi.input": io.BytesIO(request_body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for k, v in _request_headers(headers).items():
+            if k == "content-type":
+                environ["CONTENT_TYPE"] = v
+            else:
+                environ["HTTP_" + k.upper().replace("-", "_")] = v
+
+        status = []
+
+        def start_response(status_line, response_headers, exc_info=None):
+            status[:] = [int(status_line.split(" ", 1)[0])]
+
+        result = self.app(environ, start_response)
+        try:
+            content = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return Response(status[0], content)
+
+    async def request_async(self, url: str, body: str, headers: dict, timeout: float):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.request, url, body, headers, timeout
+        )
+
+
+class SchemaTransport(Transport):
+    """
+    Executes requests directly against a graphql-core schema, skipping HTTP
+    and response serialization entirely.
+    """
+
+    compress_requests = False
+
+    def __init__(self, schema, root_value=None, context_value=None):
+        self.schema = schema
+        self.root_value = root_value
+        self.context_value = context_value
+
+    def _execute_kwargs(self, body: str):
+        request = json.loads(body)
+        return dict(
+            schema=self.schema,
+            source=request["query"],
+            variable_values=request.get("variables"),
+            root_value=self.root_value,
+            context_value=self.context_value,
+        )
+
+    def request(self, url: str, body: str, headers: dict, timeout: float):
+        from graphql import graphql_sync
+
+        result = graphql_sync(**self._execute_kwargs(body))
+        return Response(200, None, raw=result, payload=result.formatted)
+
+    async def request_async(self, url: str, body: str, headers: dict, timeout: float):
+        from graphql import graphql
+
+        result = await graphql(**self._execute_kwargs(body))
+        return Response(200, None, raw=result, payload=result.formatted)
+
+
+def _installed(backend: str):
+    return importlib.util.find_spec(backend) is not None
+
+
+def check_backend(backend: str):
+    """Raise if backend isn't one of BACKENDS"""
+    if backend not in BACKENDS:
+        raise ValueError(
+            "Unknown backend {!r}, expected one of {}".format(
+                backend, ", ".join(BACKENDS)
+            )
+        )
+
+
+def transport_for(backend: str):
+    """
+    Create the transport built on one of BACKENDS
+    """
+    check_backend(backend)
+    if not _installed(backend):
+        raise ImportError("Please install '{}' to use it as backend.".format(backend))
+    if backend == "httpx":
+        return HttpxTransport()
+    elif backend == "aiohttp":
+        return AiohttpTransport()
+    return RequestsTransport()
+
+
+def default_transport(backend: str = None):
+    """
+    Pick a transport from the installed HTTP libraries, preferring async cores
+
+    Kwargs:
+       backend (str): Use this library ("httpx", "aiohttp" or "requests")
+           instead.
+    """
+    if backend is not None:
+        return transport_for(backend)
+    for backend in BACKENDS:
+        if _installed(backend):
+            return transport_for(backend)
+    raise ImportError(
+        "No HTTP client available. Please install either 'httpx', 'aiohttp' or 'requests'."
+    )
@@ -1,26 +1,49 @@
 import asyncio
+import decimal
 import enum
+import gc
+import gzip
 import json
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 from string import printable
 from unittest import mock
 from unittest.mock import patch
 
+from graphql import build_schema
 from graphql import parse
 from hypothesis import given
 from hypothesis import strategies as st
 
 from py2graphql import Aliased
+from py2graphql import BatchLoadError
 from py2graphql import Client
+from py2graphql import fingerprint
 from py2graphql import GraphQLEndpointError
 from py2graphql import GraphQLError
 from py2graphql import InfinityNotSupportedError
 from py2graphql import Literal
+from py2graphql import Mutation
+from py2graphql import NormalizedCache
+from py2graphql import profile
 from py2graphql import Query
 from py2graphql import UnserializableTypeError
 from py2graphql import ValuesRequiresArgumentsError
+from py2graphql.document import document_cache
+from py2graphql.export import ShardedExport
 from py2graphql.middleware import AddictMiddleware
 from py2graphql.middleware import AutoSubscriptingMiddleware
+from py2graphql.transport import AiohttpTransport
+from py2graphql.transport import ASGITransport
+from py2graphql.transport import AsyncTransport
+from py2graphql.transport import RequestsTransport
+from py2graphql.transport import Response
+from py2graphql.transport import SchemaTransport
+from py2graphql.transport import Transport
+from py2graphql.transport import WSGITransport
 
 
 # Helper function to create a coroutine mock
@@ -36,6 +59,133 @@ class MyEnum(enum.Enum):
     DEF = "def"
 
 
+EXPORT_SCHEMA = """
+type Item { id: Int }
+type ItemPage { nodes: [Item], endCursor: Int }
+type Query { items(start: Int!, end: Int!, after: Int): ItemPage }
+"""
+
+
+def export_items(info, start, end, after=None):
+    first = start if after is None else after + 1
+    last = min(first + 3, end)
+    return {
+        "nodes": [{"id": i} for i in range(first, last)],
+        "endCursor": last - 1 if last < end else None,
+    }
+
+
+def export_client():
+    transport = SchemaTransport(
+        build_schema(EXPORT_SCHEMA), root_value={"items": export_items}
+    )
+    return Client("http://example.com", {}, transport=transport)
+
+
+def export_build_query(client, shard, cursor):
+    query = client.query()
+    query.items(start=shard[0], end=shard[1], after=cursor).values(
+        "endCursor"
+    ).nodes.values("id")
+    return query
+
+
+def export_extract(data, shard):
+    return data["items"]["nodes"], data["items"]["endCursor"]
+
+
+NODE_SCHEMA = """
+interface Node { id: ID! }
+type Repository implements Node { id: ID!, name: String }
+type Query {
+  node(id: ID!): Node
+  nodes(ids: [ID!]!): [Node]
+}
+"""
+
+
+def repository(id):
+    if id.startswith("missing"):
+        return None
+    return {"__typename": "Repository", "id": id, "name": id.upper()}
+
+
+class CountingTransport(SchemaTransport):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = []
+
+    def request(self, url, body, headers, timeout):
+        self.queries.append(json.loads(body)["query"])
+        return super().request(url, body, headers, timeout)
+
+    async def request_async(self, url, body, headers, timeout):
+        self.queries.append(json.loads(body)["query"])
+        return await super().request_async(url, body, headers, timeout)
+
+
+def node_client():
+    transport = CountingTransport(
+        build_schema(NODE_SCHEMA),
+        root_value={
+            "node": lambda info, id: repository(id),
+            "nodes": lambda info, ids: [repository(id) for id in ids],
+        },
+    )
+    return Client("http://example.com", {}, transport=transport)
+
+
+CACHE_SCHEMA = """
+type User { id: ID!, login: String }
+type Repository { id: ID!, name: String, stars: Int, owner: User }
+type PageInfo { endCursor: String, hasNextPage: Boolean }
+type RepositoryConnection { totalCount: Int, pageInfo: PageInfo }
+type Query {
+  repository(name: String!): Repository
+  repositories(first: Int): RepositoryConnection
+  viewer: User
+}
+type Mutation { star(name: String!): Repository }
+"""
+
+
+class CacheRoot:
+    def __init__(self):
+        self.stars = 10
+        self.user = {"id": "u1", "login": "julius"}
+
+    def repository(self, info, name):
+        return {
+            "id": "r-" + name,
+            "name": name,
+            "stars": self.stars,
+            "owner": self.user,
+        }
+
+    def viewer(self, info):
+        return self.user
+
+    def repositories(self, info, first):
+        return {
+            "totalCount": 2,
+            "pageInfo": {"endCursor": "c{}".format(first), "hasNextPage": True},
+        }
+
+    def star(self, info, name):
+        self.stars += 1
+        return self.repository(info, name)
+
+
+def cache_client(**kwargs):
+    transport = CountingTransport(build_schema(CACHE_SCHEMA), root_value=CacheRoot())
+    return Client(
+        "http://example.com",
+        {},
+        transport=transport,
+        cache=NormalizedCache(**kwargs),
+    )
+
+
 class Py2GraphqlTests(unittest.TestCase):
     def test_simple(self):
         self.assertEqual(
@@ -220,11 +370,14 @@ class Py2GraphqlTests(unittest.TestCase):
             return r
 
         http_mock = mock.Mock(side_effect=fake_request)
-        with mock.patch("requests.post", http_mock):
+        with mock.patch("requests.Session.post", http_mock):
             self.assertEqual(
                 Query(
                     client=Client(
-                        "http://example.com", {}, middleware=[AddictMiddleware]
+                        "http://example.com",
+                        {},
+                        middleware=[AddictMiddleware],
+                        transport=RequestsTransport(),
                     )
                 )
                 .repository(owner="juliuscaeser", test=10)
@@ -232,6 +385,14 @@ class Py2GraphqlTests(unittest.TestCase):
                 {"title": "xxx", "url": "example.com"},
             )
 
+    def test_fetch_is_not_retried(self):
+        http_mock = mock.Mock(side_effect=ConnectionError("unreachable"))
+        with mock.patch("requests.Session.post", http_mock):
+            client = Client("http://example.com", {}, transport=RequestsTransport())
+            with self.assertRaises(ConnectionError):
+                client.query().repository(owner="juliuscaeser").values("title").fetch()
+        self.assertEqual(http_mock.call_count, 1)
+
     def test_fetch_async(self):
         async def task():
             with patch("aiohttp.ClientSession.post") as mocked:
@@ -242,7 +403,11 @@ class Py2GraphqlTests(unittest.TestCase):
                     )
                 )
                 result = (
-                    await Query(client=Client("http://example.com", {}))
+                    await Query(
+                        client=Client(
+                            "http://example.com", {}, transport=AiohttpTransport()
+                        )
+                    )
                     .repository(owner="juliuscaeser", test=10)
                     .values("title", "url")
                     .fetch_async()
@@ -271,7 +436,11 @@ class Py2GraphqlTests(unittest.TestCase):
                 mocked.return_value.__aenter__.side_effect = [Exception(), ret]
 
                 result = (
-                    await Query(client=Client("http://example.com", {}))
+                    await Query(
+                        client=Client(
+                            "http://example.com", {}, transport=AiohttpTransport()
+                        )
+                    )
                     .repository(owner="juliuscaeser", test=10)
                     .values("title", "url")
                     .fetch_async()
@@ -297,13 +466,14 @@ class Py2GraphqlTests(unittest.TestCase):
             return r
 
         http_mock = mock.Mock(side_effect=fake_request)
-        with mock.patch("requests.post", http_mock):
+        with mock.patch("requests.Session.post", http_mock):
             self.assertEqual(
                 Query(
                     client=Client(
                         "http://example.com",
                         {},
                         middleware=[AutoSubscriptingMiddleware],
+                        transport=RequestsTransport(),
                     )
                 )
                 .repository(owner="juliuscaeser", test=10)
@@ -325,11 +495,14 @@ class Py2GraphqlTests(unittest.TestCase):
             return r
 
         client = Client(
-            "http://example.com", {}, middleware=[AutoSubscriptingMiddleware]
+            "http://example.com",
+            {},
+            middleware=[AutoSubscriptingMiddleware],
+            transport=RequestsTransport(),
         )
 
         http_mock = mock.Mock(side_effect=fake_request)
-        with mock.patch("requests.post", http_mock):
+        with mock.patch("requests.Session.post", http_mock):
             for x in (
                 Query(client=client)
                 .repos(owner="juliuscaeser", test=10)
@@ -349,10 +522,10 @@ class Py2GraphqlTests(unittest.TestCase):
             )
             return r
 
-        client = Client("http://example.com", {})
+        client = Client("http://example.com", {}, transport=RequestsTransport())
 
         http_mock = mock.Mock(side_effect=fake_request)
-        with mock.patch("requests.post", http_mock):
+        with mock.patch("requests.Session.post", http_mock):
             for x in (
                 Query(client=client)
                 .repos(owner="juliuscaeser", test=10)
@@ -380,11 +553,13 @@ class Py2GraphqlTests(unittest.TestCase):
             return r
 
         http_mock = mock.Mock(side_effect=fake_request)
-        with mock.patch("requests.post", http_mock):
+        with mock.patch("requests.Session.post", http_mock):
             try:
-                Query(client=Client("http://example.com", {})).repository(
-                    owner=None, test=10
-                ).values("title", "url").fetch()
+                Query(
+                    client=Client(
+                        "http://example.com", {}, transport=RequestsTransport()
+                    )
+                ).repository(owner=None, test=10).values("title", "url").fetch()
             except GraphQLError as e:
                 self.assertEqual(
                     e.response,
@@ -411,11 +586,15 @@ class Py2GraphqlTests(unittest.TestCase):
             return r
 
         http_mock = mock.Mock(side_effect=fake_request)
-        with mock.patch("requests.post", http_mock):
+        with mock.patch("requests.Session.post", http_mock):
             try:
-                Query(client=Client("http://example.com", {})).repository(
-                    owner="juliuscaeser", test=10
-                ).values("title", "url")["repository"]
+                Query(
+                    client=Client(
+                        "http://example.com", {}, transport=RequestsTransport()
+                    )
+                ).repository(owner="juliuscaeser", test=10).values("title", "url")[
+                    "repository"
+                ]
             except GraphQLEndpointError as e:
                 self.assertEqual(e.response, '{"errors": {"repository": "xxx"}}')
             else:
@@ -432,17 +611,718 @@ class Py2GraphqlTests(unittest.TestCase):
             return r
 
         http_mock = mock.Mock(side_effect=fake_request)
-        with mock.patch("requests.post", http_mock):
+        with mock.patch("requests.Session.post", http_mock):
             try:
-                Query(client=Client("http://example.com", {})).repository(
-                    owner="juliuscaeser", test=10
-                ).values("title", "url")["repository"]
+                Query(
+                    client=Client(
+                        "http://example.com", {}, transport=RequestsTransport()
+                    )
+                ).repository(owner="juliuscaeser", test=10).values("title", "url")[
+                    "repository"
+                ]
             except GraphQLEndpointError as e:
                 self.assertEqual(e.response, "blahblah")
                 self.assertEqual(e.status_code, 400)
             else:
                 assert False
 
+    def test_custom_transport(self):
+        class StubTransport(Transport):
+            def request(self, url, body, headers, timeout):
+                self.body = json.loads(body)
+                return Response(200, json.dumps({"data": {"repository": {"id": 1}}}))
+
+            async def request_async(self, url, body, headers, timeout):
+                return self.request(url, body, headers, timeout)
+
+        transport = StubTransport()
+        client = Client("http://example.com", {}, transport=transport)
+        query = client.query().repository(owner="juliuscaeser").values("id")
+        self.assertEqual(query.fetch(), {"repository": {"id": 1}})
+        self.assertEqual(transport.body, {"query": query.to_graphql()})
+
+        loop = asyncio.new_event_loop()
+        self.assertEqual(
+            loop.run_until_complete(query.fetch_async()), {"repository": {"id": 1}}
+        )
+        loop.close()
+
+    def test_async_transport_shares_one_loop(self):
+        class StubTransport(AsyncTransport):
+            loops = set()
+
+            async def send(self, url, body, headers, timeout):
+                self.loops.add(asyncio.get_running_loop())
+                return Response(404, "not found")
+
+        client = Client("http://example.com", {}, transport=StubTransport())
+        query = client.query().repository.values("id")
+        with client:
+            with self.assertRaises(GraphQLEndpointError):
+                client.fetch(query.to_graphql())
+
+            loop = asyncio.new_event_loop()
+            with self.assertRaises(GraphQLEndpointError):
+                loop.run_until_complete(client.fetch_async(query.to_graphql()))
+            loop.close()
+        self.assertEqual(len(StubTransport.loops), 1)
+
+    def test_wsgi_transport(self):
+        def app(environ, start_response):
+            body = json.loads(environ["wsgi.input"].read())
+            assert environ["CONTENT_TYPE"] == "application/json"
+            assert environ["HTTP_AUTHORIZATION"] == "token xxx"
+            start_response("200 OK", [("Content-Type", "application/json")])
+            return [json.dumps({"data": {"query": body["query"]}}).encode()]
+
+        client = Client(
+            "http://example.com/graphql",
+            {"Authorization": "token xxx"},
+            transport=WSGITransport(app),
+        )
+        query = client.query().repository.values("id")
+        self.assertEqual(query.fetch(), {"query": query.to_graphql()})
+
+    def test_asgi_transport(self):
+        async def app(scope, receive, send):
+            assert scope["path"] == "/graphql"
+            message = await receive()
+            body = json.loads(message["body"])
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": json.dumps({"data": {"query": body["query"]}}).encode(),
+                }
+            )
+
+        client = Client("http://example.com/graphql", {}, transport=ASGITransport(app))
+        query = client.query().repository.values("id")
+        with client:
+            self.assertEqual(query.fetch(), {"query": query.to_graphql()})
+            loop = asyncio.new_event_loop()
+            self.assertEqual(
+                loop.run_until_complete(query.fetch_async()),
+                {"query": query.to_graphql()},
+            )
+            loop.close()
+
+    def test_schema_transport(self):
+        schema = build_schema("""
+            type Repository { title: String }
+            type Query { repository(owner: String!): Repository }
+            """)
+        root = {"repository": lambda info, owner: {"title": owner.upper()}}
+        client = Client(
+            "http://example.com", {}, transport=SchemaTransport(schema, root_value=root)
+        )
+        query = client.query().repository(owner="juliuscaeser").values("title")
+        self.assertEqual(query.fetch(), {"repository": {"title": "JULIUSCAESER"}})
+        loop = asyncio.new_event_loop()
+        self.assertEqual(
+            loop.run_until_complete(query.fetch_async()),
+            {"repository": {"title": "JULIUSCAESER"}},
+        )
+        loop.close()
+
+        with self.assertRaises(GraphQLError):
+            client.query().repository.values("title").fetch()
+
+    def test_fetch_many(self):
+        class StubTransport(Transport):
+            def request(self, url, body, headers, timeout):
+                query = json.loads(body)["query"]
+                if "broken" in query:
+                    return Response(200, json.dumps({"errors": [{"message": "x"}]}))
+                return Response(200, json.dumps({"data": {"query": query}}))
+
+        client = Client("http://example.com", {}, transport=StubTransport())
+        queries = [client.query().repository(number=i).values("id") for i in range(20)]
+        queries.insert(5, client.query().broken.values("id"))
+
+        results = client.fetch_many(queries, max_workers=4)
+        self.assertEqual(len(results), 21)
+        self.assertIsInstance(results[5], GraphQLError)
+        for query, result in zip(queries[6:], results[6:]):
+            self.assertEqual(result, {"query": query.to_graphql()})
+
+        completed = dict(client.fetch_as_completed(queries, max_workers=4))
+        self.assertEqual(set(completed), set(queries))
+        self.assertIsInstance(completed[queries[5]], GraphQLError)
+        self.assertEqual(completed[queries[0]], {"query": queries[0].to_graphql()})
+
+    def test_fetch_as_completed_closed_early(self):
+        class StubTransport(Transport):
+            def __init__(self):
+                self.calls = 0
+                self.started = threading.Event()
+                self.release = threading.Event()
+
+            def request(self, url, body, headers, timeout):
+                self.calls += 1
+                if self.calls > 1:
+                    self.started.set()
+                    self.release.wait()
+                return Response(200, json.dumps({"data": {}}))
+
+        transport = StubTransport()
+        client = Client("http://example.com", {}, transport=transport)
+        queries = [client.query().repository(number=i).values("id") for i in range(3)]
+
+        # Requests start before the first result is asked for
+        completed = client.fetch_as_completed(queries, max_workers=1)
+        self.assertTrue(transport.started.wait(5))
+
+        self.assertEqual(next(completed), (queries[0], {}))
+        threading.Timer(0.1, transport.release.set).start()
+        completed.close()
+        # The query that hadn't started was dropped
+        self.assertEqual(transport.calls, 2)
+
+    def test_sharded_export(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            export = ShardedExport(
+                export_client,
+                export_build_query,
+                export_extract,
+                shards=[(0, 10), (10, 12), (12, 20)],
+                output_dir=output_dir,
+                max_workers=2,
+            )
+            self.assertEqual(export.run(), [10, 2, 8])
+            ids = []
+            for index in range(3):
+                with open(export.shard_path(index) + ".jsonl") as f:
+                    ids.extend(json.loads(line)["id"] for line in f)
+            self.assertEqual(ids, list(range(20)))
+
+    def test_sharded_export_resumes(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            export = ShardedExport(
+                export_client,
+                export_build_query,
+                export_extract,
+                shards=[(0, 10)],
+                output_dir=output_dir,
+            )
+            path = export.shard_path(0)
+            # Interrupted after checkpointing the first page, and after
+            # writing (but not checkpointing) the second
+            rows = "".join(json.dumps({"id": i}) + "\n" for i in range(6))
+            with open(path + ".jsonl", "w") as f:
+                f.write(rows)
+            with open(path + ".checkpoint", "w") as f:
+                json.dump(
+                    {
+                        "cursor": 2,
+                        "count": 3,
+                        "position": len(rows) // 2,
+                        "done": False,
+                    },
+                    f,
+                )
+
+            self.assertEqual(export.run(), [10])
+            with open(path + ".jsonl") as f:
+                self.assertEqual(
+                    [json.loads(line)["id"] for line in f], list(range(10))
+                )
+
+    def test_request_compression(self):
+        class StubTransport(Transport):
+            def request(self, url, body, headers, timeout):
+                self.body = body
+                self.headers = headers
+                return Response(200, json.dumps({"data": {}}))
+
+        transport = StubTransport()
+        client = Client(
+            "http://example.com",
+            {"Authorization": "token xxx"},
+            transport=transport,
+            request_compression="gzip",
+            compression_threshold=100,
+        )
+
+        client.query().repository(owner="juliuscaeser").values("id").fetch()
+        self.assertIsInstance(transport.body, str)
+        self.assertNotIn("Content-Encoding", transport.headers)
+
+        description = "Veni, vidi, vici " * 10000
+        mutation = client.mutation().updateRepository(description=description)
+        mutation.values("id").fetch()
+        self.assertEqual(transport.headers["Content-Encoding"], "gzip")
+        self.assertEqual(transport.headers["Authorization"], "token xxx")
+        self.assertLess(len(transport.body), 1000)
+        self.assertEqual(
+            json.loads(gzip.decompress(transport.body)),
+            {"query": mutation.to_graphql()},
+        )
+
+    def test_request_compression_in_process(self):
+        client = Client(
+            "http://example.com",
+            {},
+            transport=SchemaTransport(
+                build_schema(CACHE_SCHEMA), root_value=CacheRoot()
+            ),
+            request_compression="gzip",
+            compression_threshold=0,
+        )
+        query = client.query().repository(name="rome").values("name")
+        self.assertEqual(query.fetch(), {"repository": {"name": "rome"}})
+
+    def test_request_compression_unsupported(self):
+        with self.assertRaises(ValueError):
+            Client("http://example.com", {}, request_compression="lzma")
+
+    def test_fingerprint(self):
+        def build(**kwargs):
+            query = Query()
+            query.repository(owner="juliuscaeser", **kwargs).values("title")
+            query.viewer.values(Aliased("login", "name"))
+            return query
+
+        self.assertEqual(fingerprint(build()), fingerprint(build()))
+        self.assertEqual(hash(fingerprint(build())), hash(fingerprint(build())))
+        self.assertNotEqual(fingerprint(build(x=True)), fingerprint(build(x=1)))
+        self.assertNotEqual(fingerprint(build(x=[1])), fingerprint(build(x={"a": 1})))
+        self.assertNotEqual(fingerprint(Query().a), fingerprint(Mutation().a))
+
+    def test_fingerprint_follows_changes(self):
+        query = Query()
+        repository = query.repository(owner="juliuscaeser")
+        repository.values("title")
+        before = fingerprint(query)
+        rendered = query.to_graphql()
+
+        repository.pullRequest(number=2).values("url")
+        self.assertNotEqual(fingerprint(query), before)
+        self.assertEqual(
+            query.to_graphql(indentation=0),
+            'query {repository(owner: "juliuscaeser") {title pullRequest(number: 2) {url}}}',
+        )
+        self.assertNotEqual(query.to_graphql(), rendered)
+
+    def test_document_cache(self):
+        def build():
+            return Query().repository(owner="juliuscaeser").values("title")
+
+        self.assertIs(build().to_graphql(), build().to_graphql())
+        self.assertIsNot(
+            build().to_graphql(indentation=0), build().to_graphql(indentation=2)
+        )
+
+        # Unhashable arguments aren't cached, but still render or fail as usual
+        self.assertEqual(
+            Query().repository(owner=MyEnum.ABC).values("title").to_graphql(0),
+            "query {repository(owner: ABC) {title}}",
+        )
+        with self.assertRaises(UnserializableTypeError):
+            Query().repository(owner={1, 2}).values("title").to_graphql()
+
+    def test_document_cache_skips_large_and_one_off_documents(self):
+        document_cache.clear()
+        Query().repository(body="x" * 100 * 1024).values("title").to_graphql()
+        Mutation().createIssue(body="x").values("id").to_graphql()
+        self.assertEqual(len(document_cache), 0)
+
+        Query().repository(body="x").values("title").to_graphql()
+        self.assertEqual(len(document_cache), 1)
+
+    def test_document_cache_keys(self):
+        def render(x):
+            return Query().a(x=x).values("b").to_graphql(indentation=0)
+
+        # Equal numbers that render differently don't share documents
+        self.assertEqual(render(0.0), "query {a(x: 0.0) {b}}")
+        self.assertEqual(render(-0.0), "query {a(x: -0.0) {b}}")
+        self.assertEqual(render(decimal.Decimal("1.0")), "query {a(x: 1.0) {b}}")
+        self.assertEqual(render(decimal.Decimal("1.00")), "query {a(x: 1.00) {b}}")
+
+        # Dicts and lists mutated after being passed are rendered as they are
+        # now
+        ids = [1]
+        where = {"state": "OPEN"}
+        query = Query()
+        query.repository.issues(ids=ids, where=where).values("title")
+        before = fingerprint(query)
+        query.to_graphql(indentation=0)
+        ids.append(2)
+        where["state"] = "CLOSED"
+        self.assertNotEqual(fingerprint(query), before)
+        self.assertEqual(
+            query.to_graphql(indentation=0),
+            'query {repository {issues(ids: [1, 2], where: {state: "CLOSED"}) {title}}}',
+        )
+
+    def test_alias_field(self):
+        query = Query()
+        query._field("repository", alias="rome")(name="rome").values("id")
+        self.assertEqual(
+            query.to_graphql(indentation=0),
+            'query {rome: repository(name: "rome") {id}}',
+        )
+
+    def test_dataloader(self):
+        client = node_client()
+
+        async def task():
+            loader = client.loader(["id", "name"], on="Repository")
+            first = await asyncio.gather(
+                loader.load("a"), loader.load("b"), loader.load("a")
+            )
+            second = await loader.load_many(["b", "missing"])
+            return first, second
+
+        loop = asyncio.new_event_loop()
+        first, second = loop.run_until_complete(task())
+        loop.close()
+
+        self.assertEqual(
+            first,
+            [
+                {"id": "a", "name": "A"},
+                {"id": "b", "name": "B"},
+                {"id": "a", "name": "A"},
+            ],
+        )
+        self.assertEqual(second, [{"id": "b", "name": "B"}, None])
+        self.assertEqual(
+            client.transport.queries,
+            [
+                'query {\n  n0: node(id: "a") {\n    ... on Repository {\n      id\n      name\n    }\n  }\n  n1: node(id: "b") {\n    ... on Repository {\n      id\n      name\n    }\n  }\n}',
+                'query {\n  n0: node(id: "missing") {\n    ... on Repository {\n      id\n      name\n    }\n  }\n}',
+            ],
+        )
+
+    def test_dataloader_batch_field(self):
+        client = node_client()
+
+        async def task():
+            loader = client.loader(["id"], batch_field="nodes", max_batch_size=2)
+            result = loader.load_many(["a", "b", "c"])
+            await asyncio.sleep(0)
+            # Batches in flight are referenced until they're done
+            self.assertEqual(len(loader._tasks), 2)
+            result = await result
+            self.assertEqual(loader._tasks, set())
+            return result
+
+        loop = asyncio.new_event_loop()
+        result = loop.run_until_complete(task())
+        loop.close()
+
+        self.assertEqual(result, [{"id": "a"}, {"id": "b"}, {"id": "c"}])
+        self.assertEqual(len(client.transport.queries), 2)
+        self.assertIn('nodes(ids: ["a", "b"])', client.transport.queries[0])
+
+    def test_dataloader_batch_field_mismatch(self):
+        transport = CountingTransport(
+            build_schema(NODE_SCHEMA),
+            root_value={
+                # Unknown ids are filtered out
+                "nodes": lambda info, ids: [
+                    repository(id) for id in ids if not id.startswith("missing")
+                ],
+            },
+        )
+        client = Client("http://example.com", {}, transport=transport)
+
+        async def task():
+            loader = client.loader(["id"], batch_field="nodes")
+            with self.assertRaises(BatchLoadError):
+                await asyncio.wait_for(loader.load_many(["a", "missing"]), 5)
+
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(task())
+        loop.close()
+
+    def test_dataloader_errors(self):
+        client = node_client()
+
+        async def task():
+            loader = client.loader(["id", "nonexistent"])
+            with self.assertRaises(GraphQLError):
+                await loader.load("a")
+            with self.assertRaises(GraphQLError):
+                await loader.load("a")
+
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(task())
+        loop.close()
+        # Failures aren't memoized
+        self.assertEqual(len(client.transport.queries), 2)
+
+    def test_prefetch(self):
+        class StubTransport(Transport):
+            def __init__(self):
+                self.started = threading.Event()
+                self.release = threading.Event()
+                self.queries = []
+
+            def request(self, url, body, headers, timeout):
+                self.started.set()
+                self.release.wait()
+                self.queries.append(json.loads(body)["query"])
+                data = {"repos": [{"title": "xxx"}, {"title": "yyy"}]}
+                return Response(200, json.dumps({"data": data}))
+
+        transport = StubTransport()
+        with Client("http://example.com", {}, transport=transport) as client:
+            query = client.query().repos(owner="juliuscaeser").values("title")
+            future = query.prefetch()
+            self.assertTrue(transport.started.wait(5))
+            self.assertFalse(future.done())
+            transport.release.set()
+
+            self.assertEqual([x["title"] for x in query["repos"]], ["xxx", "yyy"])
+            self.assertEqual(len(transport.queries), 1)
+
+            # The prefetched result is only used once
+            self.assertEqual(query["repos"], future.result()["repos"])
+            self.assertEqual(len(transport.queries), 2)
+
+            # Changing the tree makes the prefetched result stale
+            query.prefetch().result()
+            query.values("url")
+            query["repos"]
+            self.assertEqual(len(transport.queries), 4)
+
+    def test_prefetch_failure(self):
+        class FlakyTransport(Transport):
+            def __init__(self):
+                self.calls = 0
+
+            def request(self, url, body, headers, timeout):
+                self.calls += 1
+                if self.calls == 1:
+                    raise ConnectionError("blip")
+                data = {"repos": [{"title": "xxx"}]}
+                return Response(200, json.dumps({"data": data}))
+
+        transport = FlakyTransport()
+        with Client("http://example.com", {}, transport=transport) as client:
+            query = client.query().repos.values("title")
+            query.prefetch()
+            with self.assertRaises(ConnectionError):
+                query["repos"]
+            self.assertEqual(query["repos"], [{"title": "xxx"}])
+
+    def test_normalized_cache(self):
+        client = cache_client()
+        queries = client.transport.queries
+
+        def fetch_rome():
+            query = client.query()
+            query.repository(name="rome").values("id", "name").owner.values(
+                "id", "login"
+            )
+            return query.fetch()
+
+        expected = {
+            "repository": {
+                "id": "r-rome",
+                "name": "rome",
+                "owner": {"id": "u1", "login": "julius"},
+            }
+        }
+        self.assertEqual(fetch_rome(), expected)
+        self.assertEqual(len(queries), 1)
+        self.assertIn("__typename", queries[0])
+        self.assertEqual(len(client.cache), 3)
+
+        # Fully answered from the store
+        self.assertEqual(fetch_rome(), expected)
+        self.assertEqual(len(queries), 1)
+
+        # Only the missing field is sent, with the key fields of its entity
+        query = client.query().repository(name="rome").values("name", "stars")
+        self.assertEqual(query.fetch(), {"repository": {"name": "rome", "stars": 10}})
+        self.assertEqual(
+            queries[1],
+            'query {\n  repository(name: "rome") {\n    stars\n    id\n    __typename\n  }\n}',
+        )
+
+        # Mutation results update the stored entities
+        mutation = client.mutation().star(name="rome").values("id", "stars")
+        self.assertEqual(mutation.fetch(), {"star": {"id": "r-rome", "stars": 11}})
+        query = client.query().repository(name="rome").values("stars")
+        self.assertEqual(query.fetch(), {"repository": {"stars": 11}})
+        self.assertEqual(len(queries), 3)
+
+        # Entities are shared between root fields
+        self.assertEqual(
+            client.query().viewer.values("id").fetch(), {"viewer": {"id": "u1"}}
+        )
+        self.assertEqual(len(queries), 4)
+
+        loop = asyncio.new_event_loop()
+        query = client.query().viewer.values("id", "login")
+        self.assertEqual(
+            loop.run_until_complete(query.fetch_async()),
+            {"viewer": {"id": "u1", "login": "julius"}},
+        )
+        loop.close()
+        self.assertEqual(len(queries), 4)
+
+    def test_normalized_cache_without_ids(self):
+        client = cache_client()
+        queries = client.transport.queries
+
+        query = client.query()
+        query.repositories(first=1).pageInfo.values("endCursor")
+        self.assertEqual(
+            query.fetch(), {"repositories": {"pageInfo": {"endCursor": "c1"}}}
+        )
+        self.assertNotIn("id", queries[0])
+
+        # Objects without ids are stored inside their parent
+        query = client.query()
+        query.repositories(first=1).values("totalCount").pageInfo.values(
+            "endCursor", "hasNextPage"
+        )
+        self.assertEqual(
+            query.fetch(),
+            {
+                "repositories": {
+                    "totalCount": 2,
+                    "pageInfo": {"endCursor": "c1", "hasNextPage": True},
+                }
+            },
+        )
+        self.assertEqual(
+            queries[1],
+            "query {\n  repositories(first: 1) {\n    totalCount\n    __typename\n"
+            "    pageInfo {\n      hasNextPage\n      __typename\n    }\n  }\n}",
+        )
+        query = client.query()
+        query.repositories(first=1).pageInfo.values("hasNextPage")
+        query.fetch()
+        self.assertEqual(len(queries), 2)
+
+    def test_normalized_cache_eviction(self):
+        client = cache_client(max_entities=2, invalidate_root_on_mutation=True)
+        queries = client.transport.queries
+
+        def fetch_rome():
+            query = client.query()
+            query.repository(name="rome").values("id", "name").owner.values(
+                "id", "login"
+            )
+            return query.fetch()
+
+        fetch_rome()
+        client.query().repository(name="carthage").values("id", "name").fetch()
+        self.assertEqual(len(client.cache), 3)
+        self.assertIsNone(client.cache.get("Repository:r-rome"))
+        self.assertIsNotNone(client.cache.get("User:u1"))
+
+        # The evicted entity is fetched again
+        self.assertEqual(
+            fetch_rome(),
+            {
+                "repository": {
+                    "id": "r-rome",
+                    "name": "rome",
+                    "owner": {"id": "u1", "login": "julius"},
+                }
+            },
+        )
+        self.assertEqual(len(queries), 3)
+        self.assertIn("__typename", queries[2])
+
+        # Root fields are forgotten after a mutation
+        client.mutation().star(name="rome").values("stars").fetch()
+        fetch_rome()
+        self.assertEqual(len(queries), 5)
+
+    def test_profile(self):
+        with profile() as prof:
+            for i in range(3):
+                query = Query()
+                query.repository(owner="juliuscaeser", name="x" * 100).values("title")
+                query.repository.owner.values("login")
+                query.to_graphql()
+
+        self.assertEqual(prof.stats["query"].nodes, 3)
+        self.assertEqual(prof.stats["query"].renders, 3)
+        self.assertEqual(prof.stats["query.repository"].nodes, 6)
+        self.assertEqual(prof.stats["query.repository.owner"].renders, 3)
+        self.assertEqual(
+            prof.stats["query.repository"].arg_bytes,
+            3 * len('owner"juliuscaeser"name"{}"'.format("x" * 100)),
+        )
+        self.assertGreaterEqual(
+            prof.stats["query"].render_time,
+            prof.stats["query.repository.owner"].render_time,
+        )
+        self.assertGreater(prof.peak_allocated, 0)
+
+        report = prof.report(sort="arg_bytes", limit=1).splitlines()
+        self.assertEqual(len(report), 3)
+        self.assertTrue(report[2].endswith("  query.repository"))
+        with self.assertRaises(ValueError):
+            prof.report(sort="nonexistent")
+
+        # Nothing is recorded once profiling is off
+        Query().repository.values("title").to_graphql()
+        self.assertEqual(prof.stats["query"].nodes, 3)
+
+    def test_import_is_lazy(self):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import py2graphql"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        imported = set(
+            line.rsplit("|", 1)[1].strip()
+            for line in result.stderr.splitlines()
+            if line.startswith("import time:")
+        )
+        for module in (
+            "requests",
+            "httpx",
+            "aiohttp",
+            "tenacity",
+            "graphql",
+            "asyncio",
+            "concurrent.futures",
+        ):
+            self.assertNotIn(module, imported)
+
+    def test_async_transport_lifetime(self):
+        transport = AiohttpTransport()
+        self.assertIs(transport._loop_thread, AiohttpTransport()._loop_thread)
+
+        closed = threading.Event()
+
+        async def aclose():
+            closed.set()
+
+        # A session that's never closed explicitly is closed once the
+        # transport is collected
+        transport._opened(aclose)
+        del transport
+        gc.collect()
+        self.assertTrue(closed.wait(5))
+
+    def test_backend(self):
+        client = Client("http://example.com", {}, backend="requests")
+        self.assertIsInstance(client.transport, RequestsTransport)
+        client.close()
+
+        with self.assertRaises(ValueError):
+            Client("http://example.com", {}, backend="urllib")
+        with self.assertRaises(ValueError):
+            Client(
+                "http://example.com",
+                {},
+                backend="requests",
+                transport=RequestsTransport(),
+            )
+
     @given(st.fixed_dictionaries({"xxx": st.text(printable)}))
     def test_fuzz(self, data):
         query = (
@@ -452,6 +1332,23 @@ class Py2GraphqlTests(unittest.TestCase):
         )
         parse(str(query))
 
+    @given(st.text())
+    def test_fuzz_string_roundtrip(self, text):
+        query = Query().repository(xxx=text).values("id")
+        argument = parse(str(query)).definitions[0].selection_set.selections[0]
+        self.assertEqual(argument.arguments[0].value.value, text)
+
+    def test_string_escapes(self):
+        self.assertEqual(
+            Query()
+            .repository(x='"\\\b\f\n\r\t\v\x00\x7f\U0001f600')
+            .values("id")
+            .to_graphql(0),
+            'query {repository(x: "\\"\\\\\\b\\f\\n\\r\\t\\u000b\\u0000\x7f\U0001f600") {id}}',
+        )
+        with self.assertRaises(UnserializableTypeError):
+            Query().repository(x="\ud83d").values("id").to_graphql()
+
     @given(st.fixed_dictionaries({"xxx": st.floats(allow_infinity=True)}))
     def test_fuzz_floats(self, data):
         query = (